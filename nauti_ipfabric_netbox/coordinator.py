@@ -0,0 +1,378 @@
+"""
+This file contains the write coordinator used by the Reconcilers so that the
+collections can be reconciled concurrently into the same Netbox.  The
+interfaces, ipaddrs, portchans, and devices reconcilers write to overlapping
+Netbox objects; for example the devices reconciler creates the primary
+interface and ipaddr records that the interfaces and ipaddrs reconcilers would
+also create.
+
+The coordinator serializes the writes to each Netbox object, identified by the
+object type and the collection key, while writes to different objects run in
+parallel up to a per-source write limit.  The items of a write are still sent
+to the collection in a single request, up to the write limit in size, so that
+the collection can batch them.  Creates of an item already created by another
+reconciler are dropped, and updates to the same item that are queued behind
+another write are merged into a single request.
+
+Coordination is scoped to a reconcile run.  A Caller running reconcilers
+concurrently into the same Netbox must run them within one `coordinated_writes`
+block, and must use the same Netbox Source instance for all of them; the
+`reconcile_collections` function does this, for example:
+
+    with coordinated_writes(limit=50):
+        await asyncio.gather(
+            ifaces_reconciler.add_items(), ipaddrs_reconciler.add_items()
+        )
+
+A Reconciler phase decorated with `coordinated` that is called outside of a
+run starts its own run, so that all the writes of the phase share one
+coordinator.
+"""
+#  Copyright (C) 2020  Jeremy Schulman
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# -----------------------------------------------------------------------------
+# System Imports
+# -----------------------------------------------------------------------------
+
+import asyncio
+from typing import Dict, Tuple, Optional, List, Iterable
+from collections import defaultdict
+from functools import wraps
+from contextlib import contextmanager, asynccontextmanager, AsyncExitStack
+from contextvars import ContextVar
+
+# -----------------------------------------------------------------------------
+# Public Imports
+# -----------------------------------------------------------------------------
+
+from httpx import Response
+from nauti.collection import Collection, CollectionCallback
+from nauti.log import get_logger
+
+# -----------------------------------------------------------------------------
+# Exports
+# -----------------------------------------------------------------------------
+
+__all__ = [
+    "WriteCoordinator",
+    "coordinated",
+    "coordinated_writes",
+    "get_coordinator",
+]
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 CODE BEGINS
+#
+# -----------------------------------------------------------------------------
+
+# Collections that write to the Netbox objects of another collection; for
+# example portchans are the LAG fields of the Netbox interface objects.
+OBJECT_TYPES = {"portchans": "interfaces"}
+
+# default maximum number of concurrent writes per Netbox source.
+WRITE_LIMIT_DEFAULT = 100
+
+# The write limit and the coordinators, by Netbox source instance, of the
+# current `coordinated_writes` run.
+_run_scope: ContextVar[Optional[Tuple[Optional[int], Dict]]] = ContextVar(
+    "nauti_ipfabric_netbox_write_scope", default=None
+)
+
+
+class _PendingUpdate(object):
+    """ An update request queued behind another write to the same object """
+
+    def __init__(self, fields: Dict, callback: Optional[CollectionCallback]):
+        self.fields = dict(fields)
+        self.callbacks: List[CollectionCallback] = [callback] if callback else []
+        self.started = False
+        self.done = asyncio.Event()
+        self.error: Optional[BaseException] = None
+
+
+class _WriteSlots(object):
+    """
+    Counting semaphore limiting the number of items in flight, from which a
+    collection request acquires one slot per item.  The slots of a request are
+    acquired one request at a time so that concurrent requests cannot deadlock
+    each holding part of the slots they need.
+    """
+
+    def __init__(self, limit: int):
+        self._slots = asyncio.Semaphore(limit)
+        self._acquire = asyncio.Lock()
+
+    @asynccontextmanager
+    async def hold(self, count: int):
+        acquired = 0
+        try:
+            async with self._acquire:
+                for _ in range(count):
+                    await self._slots.acquire()
+                    acquired += 1
+            yield
+        finally:
+            for _ in range(acquired):
+                self._slots.release()
+
+
+class WriteCoordinator(object):
+    """
+    Coordinates the add, update, and delete requests of all Reconcilers
+    writing to the same Netbox source.  The methods mirror the Collection
+    methods, taking the collection as the first argument.  The items of each
+    call are sent in collection requests of up to `limit` items, and at most
+    `limit` items are in flight at any time, across all callers.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit or WRITE_LIMIT_DEFAULT
+        self._slots = _WriteSlots(self.limit)
+        self._locks: Dict[Tuple, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._created: Dict[Tuple, Response] = dict()
+        self._pending: Dict[Tuple, _PendingUpdate] = dict()
+
+    async def add_items(
+        self,
+        collection: Collection,
+        items: Dict,
+        callback: Optional[CollectionCallback] = None,
+    ):
+        """
+        Add the missing `items` to the `collection`.  An item that has already
+        been created by another reconciler is not created again; the
+        `callback` is called with the response of the original create.
+        """
+        for chunk in self._chunks(items):
+            await self._add_chunk(collection, chunk, callback)
+
+    async def update_items(
+        self,
+        collection: Collection,
+        items: Dict,
+        callback: Optional[CollectionCallback] = None,
+    ):
+        """
+        Update the existing `items` in the `collection` with the field changes.
+        Changes to an item queued behind another write to the same item are
+        merged into a single update request.
+        """
+        for chunk in self._chunks(items):
+            await self._update_chunk(collection, chunk, callback)
+
+    async def delete_items(
+        self,
+        collection: Collection,
+        items: Dict,
+        callback: Optional[CollectionCallback] = None,
+    ):
+        """ Remove the `items` from the `collection` """
+        for chunk in self._chunks(items):
+            await self._delete_chunk(collection, chunk, callback)
+
+    @asynccontextmanager
+    async def hold(self, collection: Collection, keys: Iterable):
+        """
+        Hold the write locks of all the `keys` of the `collection`, and one
+        write slot, for a request the Caller makes directly; for example a bulk
+        PATCH of many records.
+        """
+        async with self._locked(collection, keys), self._slots.hold(1):
+            yield
+
+    # -------------------------------------------------------------------------
+    #
+    #                           Private Methods
+    #
+    # -------------------------------------------------------------------------
+
+    def _chunks(self, items: Dict):
+        items = list(items.items())
+        for start in range(0, len(items), self.limit):
+            yield dict(items[start : start + self.limit])
+
+    @asynccontextmanager
+    async def _locked(self, collection: Collection, keys: Iterable):
+        """
+        Hold the write locks of all the `keys` of the `collection`.  The locks
+        are acquired in sorted order so that concurrent holders cannot
+        deadlock.
+        """
+        obj_type = OBJECT_TYPES.get(collection.name, collection.name)
+        locks = sorted({(obj_type, key) for key in keys}, key=repr)
+        async with AsyncExitStack() as stack:
+            for lock_key in locks:
+                await stack.enter_async_context(self._locks[lock_key])
+            yield
+
+    async def _add_chunk(self, collection: Collection, items: Dict, callback):
+        def _done(item, res: Response):
+            if not res.is_error:
+                self._created[(collection.name, item[0])] = res
+            if callback:
+                callback(item, res)
+
+        async with self._locked(collection, items):
+            new_items = dict()
+            for key, fields in items.items():
+                if (res := self._created.get((collection.name, key))) is None:
+                    new_items[key] = fields
+                    continue
+
+                get_logger().debug(f"CREATE:SKIP: {collection.name} {key}: exists.")
+                if callback:
+                    callback((key, fields), res)
+
+            if not new_items:
+                return
+
+            async with self._slots.hold(len(new_items)):
+                await collection.add_items(new_items, callback=_done)
+
+    async def _update_chunk(self, collection: Collection, items: Dict, callback):
+        owned = dict()
+        merged = list()
+
+        for key, fields in items.items():
+            item_key = (collection.name, key)
+            if (pending := self._pending.get(item_key)) is not None:
+                pending.fields.update(fields)
+                if callback:
+                    pending.callbacks.append(callback)
+                merged.append((key, fields, pending))
+                continue
+
+            owned[key] = self._pending[item_key] = _PendingUpdate(fields, callback)
+
+        if owned:
+            await self._send_updates(collection, owned)
+
+        requeue = dict()
+
+        for key, fields, pending in merged:
+            await pending.done.wait()
+            if pending.error is None:
+                continue
+
+            if not isinstance(pending.error, asyncio.CancelledError):
+                raise pending.error
+
+            if pending.started:
+                raise RuntimeError(
+                    f"update {collection.name} {key} cancelled"
+                ) from pending.error
+
+            # the owner of the merged update was cancelled before sending it,
+            # so queue the changes of this caller again.
+            requeue[key] = fields
+
+        if requeue:
+            await self._update_chunk(collection, requeue, callback)
+
+    async def _send_updates(self, collection: Collection, owned: Dict):
+        def _done(item, res: Response):
+            for _callback in owned[item[0]].callbacks:
+                _callback(item, res)
+
+        try:
+            async with self._locked(collection, owned):
+                # once the locks are held no more changes can be merged into
+                # the request.
+                for key in owned:
+                    del self._pending[(collection.name, key)]
+
+                async with self._slots.hold(len(owned)):
+                    for pending in owned.values():
+                        pending.started = True
+
+                    await collection.update_items(
+                        {key: pending.fields for key, pending in owned.items()},
+                        callback=_done,
+                    )
+
+        except BaseException as exc:
+            for pending in owned.values():
+                pending.error = exc
+            raise
+
+        finally:
+            for key, pending in owned.items():
+                if self._pending.get((collection.name, key)) is pending:
+                    del self._pending[(collection.name, key)]
+                pending.done.set()
+
+    async def _delete_chunk(self, collection: Collection, items: Dict, callback):
+        async with self._locked(collection, items):
+            async with self._slots.hold(len(items)):
+                await collection.delete_items(items, callback=callback)
+
+            for key in items:
+                self._created.pop((collection.name, key), None)
+
+
+def coordinated(method):
+    """
+    Decorator for a Reconciler phase coroutine method.  When the method is
+    called outside of a `coordinated_writes` run, the method is run within its
+    own run.
+    """
+
+    @wraps(method)
+    async def wrapper(self, *vargs, **kwargs):
+        if _run_scope.get() is not None:
+            return await method(self, *vargs, **kwargs)
+
+        with coordinated_writes():
+            return await method(self, *vargs, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def coordinated_writes(limit: Optional[int] = None):
+    """
+    Scope a reconcile run so that all the writes made within it to the same
+    Netbox source instance share one WriteCoordinator.  The coordinators, and
+    their record of created items, are discarded when the run exits.
+
+    Parameters
+    ----------
+    limit:
+        Optional maximum number of concurrent writes to each Netbox source.
+    """
+    token = _run_scope.set((limit, dict()))
+    try:
+        yield
+    finally:
+        _run_scope.reset(token)
+
+
+def get_coordinator(source) -> WriteCoordinator:
+    """
+    Return the WriteCoordinator for the given Netbox `source` instance in the
+    current `coordinated_writes` run, creating it on first use.  Outside of a
+    run a new coordinator is returned on each call.
+    """
+    if (scope := _run_scope.get()) is None:
+        return WriteCoordinator()
+
+    limit, coordinators = scope
+    if (coord := coordinators.get(source)) is None:
+        coord = coordinators[source] = WriteCoordinator(limit=limit)
+
+    return coord
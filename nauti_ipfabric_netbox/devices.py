@@ -17,6 +17,9 @@ Device collection.
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+from typing import Optional
+from collections import defaultdict
 
 from httpx import Response
 
@@ -26,6 +29,16 @@ from nauti.collection import get_collection
 from nauti.diff import diff
 from nauti.igather import iawait
 
+from nauti_ipfabric_netbox.profiling import profiled
+from nauti_ipfabric_netbox.coordinator import coordinated, get_coordinator
+from nauti_ipfabric_netbox.fanout import ORIGIN_LOOKUPS
+
+# maximum number of devices combined into a single IP Fabric lookup request.
+IPF_FILTER_BATCH_SIZE = 50
+
+# minimum Netbox API version supporting bulk updates of a list of records.
+NETBOX_BULK_API_VERSION = (2, 10)
+
 
 @Reconciler.register(origin="ipfabric", target="netbox", collection="devices")
 class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
@@ -40,12 +53,22 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
     #
     # -------------------------------------------------------------------------
 
+    @profiled
+    @coordinated
     async def add_items(self):
 
         # -------------------------------------------------------------------------
-        # Now create each of the device records.  Once the device records are
+        # Now create each of the device records.  The IP Fabric primary interface
+        # and ipaddress records are fetched at the same time, since they do not
+        # depend on the Netbox device records.  Once the device records are
         # created, then go back and add the primary interface and ipaddress values
         # using the other collections.
+        #
+        # NOTE: the Netbox device, interface, and ipaddr records are created one
+        # request per record by the Netbox collections, which own the create
+        # payload mapping.  The IP Fabric lookups are batched, and the Netbox
+        # ipaddr lookups are skipped since a new device cannot have any assigned
+        # ipaddrs.
         # -------------------------------------------------------------------------
 
         ipf_col = self.origin
@@ -53,8 +76,11 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
         missing = self.diff_res.missing
 
         log = get_logger()
+        api_version = None
 
         def _report_device(update, _res: Response):
+            nonlocal api_version
+
             key, item = update
             if _res.is_error:
                 log.error(f"FAIL: create device {item['hostname']}: {_res.text}")
@@ -64,17 +90,30 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
                 f"CREATE:OK: device {item['hostname']} ... creating primary IP ... "
             )
             nb_col.source_records.append(_res.json())
+            api_version = _res.headers.get("API-Version")
 
-        await nb_col.add_items(items=missing, callback=_report_device)
-        await self._ensure_primary_ipaddrs(missing=missing)
+        await _gather_or_cancel(
+            get_coordinator(nb_col.source).add_items(
+                nb_col, items=missing, callback=_report_device
+            ),
+            self._fetch_ipf_primary_ipaddrs(missing=missing),
+        )
+        await self._ensure_primary_ipaddrs(missing=missing, created=True)
 
         # -------------------------------------------------------------------------
-        # for each of the missing device records perform a "change request" on the
-        # 'ipaddr' field. so that the primary IP will be assigned.
+        # Assign the primary IP for all of the new devices in a single bulk
+        # request when the Netbox supports it.  Any devices that could not be
+        # assigned that way fall back to a "change request" on the 'ipaddr' field.
         # -------------------------------------------------------------------------
 
+        pending = await self._assign_primary_ipaddrs(
+            missing=missing, api_version=api_version
+        )
+        if not pending:
+            return
+
         ipaddr_changes = {
-            key: {"ipaddr": ipf_col.items[key]["ipaddr"]} for key in missing.keys()
+            key: {"ipaddr": ipf_col.items[key]["ipaddr"]} for key in pending
         }
 
         def _report_primary(item, _res):  # noqa
@@ -87,7 +126,9 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
 
             log.info(f"CREATE:OK: {ident}.")
 
-        await nb_col.update_items(items=ipaddr_changes, callback=_report_primary)
+        await get_coordinator(nb_col.source).update_items(
+            nb_col, items=ipaddr_changes, callback=_report_primary
+        )
 
     # -------------------------------------------------------------------------
     #
@@ -95,6 +136,8 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
     #
     # -------------------------------------------------------------------------
 
+    @profiled
+    @coordinated
     async def update_items(self):
 
         # TODO: need to test out update to device items
@@ -139,7 +182,9 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
             return
 
         log.info("Processing changes ... ")
-        await nb_col.update_items(changes, callback=_report)
+        await get_coordinator(nb_col.source).update_items(
+            nb_col, actual_changes, callback=_report
+        )
         log.info("Done.")
 
     # -------------------------------------------------------------------------
@@ -148,13 +193,38 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
     #
     # -------------------------------------------------------------------------
 
-    async def _ensure_primary_ipaddrs(self, missing: dict):
+    @profiled
+    async def _fetch_ipf_primary_ipaddrs(self, missing: dict):
+        """
+        Fetch the IP Fabric ipaddr and interface records used as the primary IP
+        for each of the `missing` devices.  The fetched records are cached in
+        the `_ipf_lookups` so that reconciling the same IP Fabric snapshot into
+        multiple Netbox targets only looks up each device once.
+
+        Returns
+        -------
+        Tuple[Collection, Collection]
+            The IPF ipaddrs and interfaces collections, keyed, containing only
+            the records for the `missing` devices.
+        """
         log = get_logger()
 
         ipf_col = self.origin
+        cache = self._ipf_lookups()
+
+        if "primary_ipaddrs" not in cache:
+            cache["primary_ipaddrs"] = get_collection(
+                source=ipf_col.source, name="ipaddrs"
+            )
+            cache["primary_interfaces"] = get_collection(
+                source=ipf_col.source, name="interfaces"
+            )
+            cache["primary_fetched"] = set()
+            cache["primary_lock"] = asyncio.Lock()
 
-        ipf_col_ipaddrs = get_collection(source=ipf_col.source, name="ipaddrs")
-        ipf_col_ifaces = get_collection(source=ipf_col.source, name="interfaces")
+        ipf_col_ipaddrs = cache["primary_ipaddrs"]
+        ipf_col_ifaces = cache["primary_interfaces"]
+        fetched = cache["primary_fetched"]
 
         # -------------------------------------------------------------------------
         # we need to fetch all of the IPF ipaddr records so that we can bind the
@@ -163,36 +233,111 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
         # match.  This is done to avoid any mapping changes that happended via the
         # collection intake process.  This code is a bit of 'leaky-abstration',
         # so TODO: cleanup.
+        #
+        # Only the devices not already fetched for another target are looked up;
+        # the lock ensures concurrent targets do not fetch the same devices.
         # -------------------------------------------------------------------------
 
-        log.info("Fetching IP Fabric IP records ...")
-        tasks = [
-            ipf_col_ipaddrs.fetch(
-                filters=f"and(hostname = '{_item['hostname']}', ip = '{_item['loginIp']}')"
-            )
-            for _item in [ipf_col.source_record_keys[key] for key in missing.keys()]
-        ]
-
-        await iawait(tasks, limit=50)
-        ipf_col_ipaddrs.make_keys()
-
-        # -------------------------------------------------------------------------
-        # now we need to gather the IPF interface records so we have any _fields that
-        # need to be stored into Netbox (e.g. description)
-        # -------------------------------------------------------------------------
-
-        log.info("Fetching IP Fabric interface records ...")
-
-        tasks = [
-            ipf_col_ifaces.fetch(
-                hostname=_item["hostname"],
-                filters=f"and(hostname = '{_item['hostname']}', intName = '{_item['intName']}')",
-            )
-            for _item in ipf_col_ipaddrs.source_record_keys.values()
+        async with cache["primary_lock"]:
+            need_keys = [key for key in missing.keys() if key not in fetched]
+            need_ipaddrs = len(ipf_col_ipaddrs.source_records)
+
+            if need_keys:
+                log.info("Fetching IP Fabric IP records ...")
+                tasks = [
+                    ipf_col_ipaddrs.fetch(filters=_filters)
+                    for _filters in self._ipf_or_filters(
+                        f"and(hostname = '{_item['hostname']}', ip = '{_item['loginIp']}')"
+                        for _item in [
+                            ipf_col.source_record_keys[key] for key in need_keys
+                        ]
+                    )
+                ]
+
+                await iawait(tasks, limit=50)
+                ipf_col_ipaddrs.make_keys()
+
+                # ---------------------------------------------------------------------
+                # now we need to gather the IPF interface records so we have any _fields
+                # that need to be stored into Netbox (e.g. description)
+                # ---------------------------------------------------------------------
+
+                log.info("Fetching IP Fabric interface records ...")
+
+                # the interfaces fetch is per hostname, so the filters are only
+                # combined for the interfaces of the same device.
+
+                host_filters = defaultdict(list)
+                for _item in ipf_col_ipaddrs.source_records[need_ipaddrs:]:
+                    host_filters[_item["hostname"]].append(
+                        f"and(hostname = '{_item['hostname']}', intName = '{_item['intName']}')"
+                    )
+
+                tasks = [
+                    ipf_col_ifaces.fetch(hostname=_hostname, filters=_filters)
+                    for _hostname, _filters_list in host_filters.items()
+                    for _filters in self._ipf_or_filters(_filters_list)
+                ]
+
+                await iawait(tasks, limit=50)
+                ipf_col_ifaces.make_keys()
+                fetched.update(need_keys)
+
+        hostnames = {ipf_col.source_record_keys[key]["hostname"] for key in missing}
+
+        return (
+            self._ipf_subset(ipf_col_ipaddrs, hostnames),
+            self._ipf_subset(ipf_col_ifaces, hostnames),
+        )
+
+    def _ipf_lookups(self) -> dict:
+        """
+        Return the cache of IP Fabric lookups.  The cache is shared by the
+        targets of a `reconcile_targets` call, and otherwise only used by this
+        reconciler.
+        """
+        if (lookups := self.origin.cache.get(ORIGIN_LOOKUPS)) is None:
+            lookups = vars(self).setdefault("_lookups", dict())
+
+        return lookups
+
+    @staticmethod
+    def _ipf_or_filters(filters, batch_size=IPF_FILTER_BATCH_SIZE):
+        """
+        Combine the per-record `filters` into "or" filters of up to
+        `batch_size` terms each so that many records are fetched in a single
+        IP Fabric request.
+        """
+        filters = list(filters)
+        for start in range(0, len(filters), batch_size):
+            yield f"or({', '.join(filters[start:start + batch_size])})"
+
+    @staticmethod
+    def _ipf_subset(ipf_col, hostnames):
+        """
+        Return a new keyed collection containing only the `ipf_col` source
+        records for the given `hostnames`.
+        """
+        subset = get_collection(source=ipf_col.source, name=ipf_col.name)
+        subset.source_records = [
+            rec for rec in ipf_col.source_records if rec["hostname"] in hostnames
         ]
+        subset.make_keys()
+        return subset
+
+    @profiled
+    async def _ensure_primary_ipaddrs(self, missing: dict, created: bool = False):
+        """
+        Ensure the primary interface and ipaddr records of the `missing` devices
+        exist in Netbox.  When `created` is True the devices were just created,
+        so they cannot have any assigned ipaddrs and the Netbox ipaddr lookups
+        are skipped.
+        """
+        log = get_logger()
 
-        await iawait(tasks, limit=50)
-        ipf_col_ifaces.make_keys()
+        ipf_col_ipaddrs, ipf_col_ifaces = await self._fetch_ipf_primary_ipaddrs(
+            missing=missing
+        )
 
         # -------------------------------------------------------------------------
         # At this point we have the IPF collections for the needed 'interfaces' and
@@ -207,7 +352,8 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
         nb_col_ipaddrs = get_collection(source=nb_col.source, name="ipaddrs")
 
         await nb_col_ifaces.fetch_items(items=ipf_col_ifaces.items)
-        await nb_col_ipaddrs.fetch_items(items=ipf_col_ipaddrs.items)
+        if not created:
+            await nb_col_ipaddrs.fetch_items(items=ipf_col_ipaddrs.items)
 
         nb_col_ipaddrs.make_keys()
         nb_col_ifaces.make_keys()
@@ -226,8 +372,8 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
             nb_col_ifaces.source_records.append(_res.json())
 
         if diff_ifaces.missing:
-            await nb_col_ifaces.add_items(
-                items=diff_ifaces.missing, callback=_report_iface
+            await get_coordinator(nb_col_ifaces.source).add_items(
+                nb_col_ifaces, items=diff_ifaces.missing, callback=_report_iface
             )
 
         def _report_ipaddr(item, _res: Response):
@@ -247,8 +393,8 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
             log.info(f"CREATE:OK: {ident}.")
 
         if diff_ipaddrs.missing:
-            await nb_col_ipaddrs.add_items(
-                items=diff_ipaddrs.missing, callback=_report_ipaddr
+            await get_coordinator(nb_col_ipaddrs.source).add_items(
+                nb_col_ipaddrs, items=diff_ipaddrs.missing, callback=_report_ipaddr
             )
 
         nb_col.make_keys()
@@ -261,3 +407,141 @@ class IPFabricNetboxDeviceCollectionReconciler(Reconciler):
 
         nb_col.cache["interfaces"] = nb_col_ifaces
         nb_col.cache["ipaddrs"] = nb_col_ipaddrs
+
+    @profiled
+    async def _assign_primary_ipaddrs(
+        self, missing: dict, api_version: Optional[str] = None
+    ):
+        """
+        Assign the primary IP of the newly created `missing` devices using a
+        single bulk PATCH request to the Netbox devices API.  The request holds
+        the write coordinator locks of the devices so that it does not race any
+        other update to them.  This method must be called after
+        `_ensure_primary_ipaddrs` so that the Netbox ipaddrs collection is
+        cached.
+
+        The request is made directly with the Netbox source client, since the
+        Netbox collections only update one record per request; see
+        `_netbox_bulk_supported` for the requirements.  When they are not met
+        no request is made and all the devices are returned.
+
+        Parameters
+        ----------
+        missing:
+            The missing device items.
+
+        api_version:
+            The Netbox API version, from the "API-Version" header of a Netbox
+            response.
+
+        Returns
+        -------
+        List
+            The keys of the devices that were not assigned, and should be
+            assigned via the 'ipaddr' change request.
+        """
+        log = get_logger()
+
+        ipf_col = self.origin
+        nb_col = self.target
+        nb_col_ipaddrs = nb_col.cache["ipaddrs"]
+
+        # index the Netbox ipaddr record IDs by (hostname, address-without-prefixlen)
+
+        ipaddr_ids = {
+            (item["hostname"], item["ipaddr"].split("/")[0]): (
+                nb_col_ipaddrs.source_record_keys[key]["id"]
+            )
+            for key, item in nb_col_ipaddrs.items.items()
+        }
+
+        payload = list()
+        assigned = dict()
+        pending = list()
+
+        for key in missing.keys():
+            if (dev_rec := nb_col.source_record_keys.get(key)) is None:
+                # device create failed, already reported.
+                continue
+
+            hostname = nb_col.items[key]["hostname"]
+            ipaddr = ipf_col.items[key]["ipaddr"].split("/")[0]
+
+            if (ipaddr_id := ipaddr_ids.get((hostname, ipaddr))) is None:
+                pending.append(key)
+                continue
+
+            payload.append({"id": dev_rec["id"], "primary_ip4": ipaddr_id})
+            assigned[key] = hostname
+
+        if not payload:
+            return pending
+
+        if not _netbox_bulk_supported(nb_col.source, api_version):
+            log.info("Netbox bulk update not supported, assigning primary-ip4 ...")
+            return pending + list(assigned)
+
+        async with get_coordinator(nb_col.source).hold(nb_col, assigned.keys()):
+            res: Response = await nb_col.source.client.patch(
+                "/dcim/devices/", json=payload
+            )
+
+        if res.is_error:
+            log.error(f"CREATE:FAIL: bulk assign primary-ip4: {res.text}")
+            return pending + list(assigned)
+
+        for hostname in assigned.values():
+            log.info(f"CREATE:OK: device {hostname} assigned primary-ip4.")
+
+        return pending
+
+
+def _netbox_bulk_supported(nb_source, api_version: Optional[str]) -> bool:
+    """
+    Returns True when the Netbox records can be updated with a single bulk
+    PATCH request of a list of records made directly with the Netbox source
+    client.  This requires that:
+
+        * the Netbox source has the `client` attribute, an httpx.AsyncClient
+        * the client base URL is the Netbox API root, ending in "/api"
+        * the Netbox API version is 2.10 or later, which supports bulk updates
+
+    Parameters
+    ----------
+    nb_source:
+        The Netbox source instance.
+
+    api_version:
+        The Netbox API version, from the "API-Version" header of a Netbox
+        response; for example "2.10".
+    """
+    if (client := getattr(nb_source, "client", None)) is None:
+        return False
+
+    if not str(getattr(client, "base_url", "")).rstrip("/").endswith("/api"):
+        return False
+
+    try:
+        version = tuple(int(num) for num in api_version.split(".")[:2])
+    except (AttributeError, ValueError):
+        return False
+
+    return version >= NETBOX_BULK_API_VERSION
+
+
+async def _gather_or_cancel(*coros):
+    """
+    Run the `coros` concurrently and return their results.  When any of them
+    raises an exception the others are cancelled, and then the exception is
+    raised.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+
+    try:
+        return await asyncio.gather(*tasks)
+
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
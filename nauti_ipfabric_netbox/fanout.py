@@ -0,0 +1,252 @@
+"""
+This file contains the code to reconcile a single IP Fabric collection into
+multiple Netbox targets, for example a staging and production Netbox.  The IP
+Fabric collection is fetched and keyed once by the Caller, and then diffed and
+reconciled concurrently against each of the Netbox targets.
+
+This file also contains the code to reconcile multiple IP Fabric collections
+concurrently into a single Netbox target, sharing one write coordinator.
+"""
+#  Copyright (C) 2020  Jeremy Schulman
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# -----------------------------------------------------------------------------
+# System Imports
+# -----------------------------------------------------------------------------
+
+import asyncio
+from typing import Dict, Optional, Sequence, Tuple, Type
+
+# -----------------------------------------------------------------------------
+# Public Imports
+# -----------------------------------------------------------------------------
+
+from nauti.tasks.reconile import Reconciler
+from nauti.collection import Collection, get_collection
+from nauti.source import Source
+from nauti.diff import diff
+from nauti.igather import igather
+from nauti.log import get_logger
+
+# -----------------------------------------------------------------------------
+# Private Imports
+# -----------------------------------------------------------------------------
+
+from nauti_ipfabric_netbox.coordinator import coordinated_writes
+
+# -----------------------------------------------------------------------------
+# Exports
+# -----------------------------------------------------------------------------
+
+__all__ = ["reconcile_targets", "reconcile_collections", "ORIGIN_LOOKUPS"]
+
+# the `origin.cache` key of the IP Fabric lookups shared by the targets of one
+# `reconcile_targets` call.
+ORIGIN_LOOKUPS = "lookups"
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 CODE BEGINS
+#
+# -----------------------------------------------------------------------------
+
+
+async def reconcile_targets(
+    origin: Collection,
+    targets: Dict[str, Source],
+    reconciler: Type[Reconciler],
+    fetch_args: Optional[Dict] = None,
+    limit: Optional[int] = None,
+    write_limit: Optional[int] = None,
+) -> Dict:
+    """
+    Reconcile the `origin` collection into each of the Netbox `targets`.  The
+    `origin` collection must already be fetched and keyed; it is shared
+    read-only by all targets so that IP Fabric is only queried once.  Any IP
+    Fabric lookups the `reconciler` caches in `origin.cache[ORIGIN_LOOKUPS]`
+    are likewise shared across targets; they are cleared when the call
+    returns, so a later call looks them up again.
+
+    Each target is reconciled in its own `coordinated_writes` run, so each
+    target has its own write coordinator and write limit, and the writes for
+    one target do not queue behind another.
+
+    Parameters
+    ----------
+    origin:
+        The fetched and keyed IP Fabric collection.
+
+    targets:
+        Dictionary mapping a target name (e.g. "staging") to its Netbox source
+        instance.
+
+    reconciler:
+        The Reconciler class registered for the collection.
+
+    fetch_args:
+        Optional arguments passed to each Netbox collection fetch.
+
+    limit:
+        Optional maximum number of targets reconciled concurrently.
+
+    write_limit:
+        Optional maximum number of concurrent writes to each target.
+
+    Returns
+    -------
+    Dict
+        Mapping target name to the DiffResults for that target, None when the
+        target was already in sync, or the Exception raised while reconciling
+        that target.
+    """
+    log = get_logger()
+
+    async def _run(name: str, source: Source):
+        try:
+            with coordinated_writes(limit=write_limit):
+                return await _reconcile(name, origin, source, reconciler, fetch_args)
+        except Exception as exc:  # noqa
+            log.error(f"{name}: FAIL: {exc}")
+            return exc
+
+    tasks = {_run(name, source): name for name, source in targets.items()}
+    results = dict()
+
+    origin.cache[ORIGIN_LOOKUPS] = dict()
+
+    try:
+        async for orig_coro, res in igather(tasks, limit=limit):
+            name = tasks[orig_coro]
+            results[name] = res
+            _report_done(name, res)
+
+    finally:
+        del origin.cache[ORIGIN_LOOKUPS]
+
+    return results
+
+
+async def reconcile_collections(
+    origins: Sequence[Tuple[Collection, Type[Reconciler]]],
+    target: Source,
+    fetch_args: Optional[Dict[str, Dict]] = None,
+    write_limit: Optional[int] = None,
+) -> Dict:
+    """
+    Reconcile each of the `origins` collections concurrently into the Netbox
+    `target`.  The collections are reconciled in one `coordinated_writes` run,
+    so that their writes to the same Netbox objects are serialized, duplicate
+    creates are dropped, and queued updates are merged.
+
+    The collections must not depend on the records another of the collections
+    creates; for example the devices must be reconciled before the interfaces
+    of new devices.
+
+    Parameters
+    ----------
+    origins:
+        The fetched and keyed IP Fabric collections, each with the Reconciler
+        class registered for the collection.
+
+    target:
+        The Netbox source instance.
+
+    fetch_args:
+        Optional dictionary mapping a collection name to the arguments passed
+        to the Netbox collection fetch.
+
+    write_limit:
+        Optional maximum number of concurrent writes to the target.
+
+    Returns
+    -------
+    Dict
+        Mapping collection name to the DiffResults for that collection, None
+        when the collection was already in sync, or the Exception raised while
+        reconciling that collection.
+    """
+    log = get_logger()
+    fetch_args = fetch_args or {}
+
+    async def _run(origin: Collection, reconciler: Type[Reconciler]):
+        try:
+            return await _reconcile(
+                origin.name,
+                origin,
+                target,
+                reconciler,
+                fetch_args.get(origin.name),
+            )
+        except Exception as exc:  # noqa
+            log.error(f"{origin.name}: FAIL: {exc}")
+            return exc
+
+    with coordinated_writes(limit=write_limit):
+        results = await asyncio.gather(
+            *(_run(origin, reconciler) for origin, reconciler in origins)
+        )
+
+    for (origin, _), res in zip(origins, results):
+        _report_done(origin.name, res)
+
+    return {origin.name: res for (origin, _), res in zip(origins, results)}
+
+
+async def _reconcile(
+    name: str,
+    origin: Collection,
+    source: Source,
+    reconciler: Type[Reconciler],
+    fetch_args: Optional[Dict],
+):
+    """
+    Fetch the Netbox collection for the `origin` collection from the Netbox
+    `source`, and reconcile the differences.  Returns the DiffResults, or None
+    when there are no differences.
+    """
+    log = get_logger()
+    nb_col = get_collection(source=source, name=origin.name)
+
+    log.info(f"{name}: Fetching Netbox {origin.name} ...")
+    await nb_col.fetch(**(fetch_args or {}))
+    nb_col.make_keys()
+
+    if not (diff_res := diff(origin=origin, target=nb_col)):
+        log.info(f"{name}: No differences.")
+        return None
+
+    rcler = reconciler(diff_res=diff_res)
+
+    if diff_res.missing:
+        await rcler.add_items()
+
+    if diff_res.changes:
+        await rcler.update_items()
+
+    if diff_res.extras:
+        await rcler.delete_items()
+
+    return diff_res
+
+
+def _report_done(name: str, res):
+    if res is None or isinstance(res, Exception):
+        return
+
+    get_logger().info(
+        f"{name}: DONE: {len(res.missing)} missing, "
+        f"{len(res.changes)} changes, {len(res.extras)} extras."
+    )
@@ -27,6 +27,13 @@ from httpx import Response
 from nauti.tasks.reconile import Reconciler
 from nauti.log import get_logger
 
+# -----------------------------------------------------------------------------
+# Private Imports
+# -----------------------------------------------------------------------------
+
+from nauti_ipfabric_netbox.profiling import profiled
+from nauti_ipfabric_netbox.coordinator import get_coordinator
+
 
 @Reconciler.register(origin="ipfabric", target="netbox", collection="interfaces")
 class IPFabricNetboxInterfaceReconciler(Reconciler):
@@ -37,6 +44,7 @@ class IPFabricNetboxInterfaceReconciler(Reconciler):
     #
     # -------------------------------------------------------------------------
 
+    @profiled
     async def add_items(self):
         nb_col = self.diff_res.target
         missing = self.diff_res.missing
@@ -50,9 +58,12 @@ class IPFabricNetboxInterfaceReconciler(Reconciler):
             log.info(f"CREATE:OK: interface {_hostname}, {_if_name}")
 
         log.info("CREATE:BEGIN: Netbox interfaces ...")
-        await nb_col.add_items(items=missing, callback=_done)
+        await get_coordinator(nb_col.source).add_items(
+            nb_col, items=missing, callback=_done
+        )
         log.info("CREATE:DONE: Netbox interfaces.")
 
+    @profiled
     async def update_items(self):
         nb_col = self.diff_res.target
         changes = self.diff_res.changes
@@ -68,9 +79,12 @@ class IPFabricNetboxInterfaceReconciler(Reconciler):
             log.info(f"CHANGE:OK: interface {_hostname}, {_ifname}")
 
         log.info("CHANGE:BEGIN: Netbox interfaces ...")
-        await nb_col.update_items(items=changes, callback=_done)
+        await get_coordinator(nb_col.source).update_items(
+            nb_col, items=changes, callback=_done
+        )
         log.info("CHANGE:DONE: Netbox interfaces.")
 
+    @profiled
     async def delete_items(self):
         nb_col = self.diff_res.target
         changes = self.diff_res.extras
@@ -86,5 +100,7 @@ class IPFabricNetboxInterfaceReconciler(Reconciler):
             log.info(f"DELETE:OK: interface {_hostname}, {_ifname}")
 
         log.info("DELETE:BEGIN: Netbox interfaces ...")
-        await nb_col.delete_items(items=changes, callback=_done)
+        await get_coordinator(nb_col.source).delete_items(
+            nb_col, items=changes, callback=_done
+        )
         log.info("DELETE:DONE: Netbox interfaces.")
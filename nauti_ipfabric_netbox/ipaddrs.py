@@ -27,9 +27,17 @@ from httpx import Response
 from nauti.tasks.reconile import Reconciler
 from nauti.log import get_logger
 
+# -----------------------------------------------------------------------------
+# Private Imports
+# -----------------------------------------------------------------------------
+
+from nauti_ipfabric_netbox.profiling import profiled
+from nauti_ipfabric_netbox.coordinator import get_coordinator
+
 
 @Reconciler.register(origin="ipfabric", target="netbox", collection="ipaddrs")
 class ReconcileIPFabricNetboxIPaddrs(Reconciler):
+    @profiled
     async def add_items(self):
         nb_col = self.target
         log = get_logger()
@@ -41,9 +49,12 @@ class ReconcileIPFabricNetboxIPaddrs(Reconciler):
             log.info(f"CREATE:OK: {ident}")
 
         log.info("CREATE:BEGIN: Netbox ipaddrs ...")
-        await nb_col.add_items(self.diff_res.missing, callback=_done)
+        await get_coordinator(nb_col.source).add_items(
+            nb_col, self.diff_res.missing, callback=_done
+        )
         log.info("CREATE:DONE: Netbox ipaddrs.")
 
+    @profiled
     async def update_items(self):
         nb_col = self.target
         changes = self.diff_res.changes
@@ -56,9 +67,12 @@ class ReconcileIPFabricNetboxIPaddrs(Reconciler):
             log.info(f"UPDATE:OK: ipaddr {_hostname}, {_ifname}")
 
         log.info("UPDATE:BEGIN: Netbox ipaddrs ...")
-        await nb_col.update_items(changes, callback=_done)
+        await get_coordinator(nb_col.source).update_items(
+            nb_col, changes, callback=_done
+        )
         log.info("UPDATE:DONE: Netbox ipaddrs.")
 
+    @profiled
     async def delete_items(self):
         nb_col = self.target
         changes = self.diff_res.extras
@@ -72,5 +86,7 @@ class ReconcileIPFabricNetboxIPaddrs(Reconciler):
             log.info(f"DELETE:OK: ipaddr {_hostname}, {_ipaddr}")
 
         log.info("DELETE:BEGIN: Netbox ipaddrs ...")
-        await nb_col.delete_items(changes, callback=_done)
+        await get_coordinator(nb_col.source).delete_items(
+            nb_col, changes, callback=_done
+        )
         log.info("DELETE:DONE: Netbox ipaddrs.")
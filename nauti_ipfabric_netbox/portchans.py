@@ -21,6 +21,13 @@ from httpx import Response
 from nauti.tasks.reconile import Reconciler
 from nauti.log import get_logger
 
+# -----------------------------------------------------------------------------
+# Private Imports
+# -----------------------------------------------------------------------------
+
+from nauti_ipfabric_netbox.profiling import profiled
+from nauti_ipfabric_netbox.coordinator import get_coordinator
+
 
 # -----------------------------------------------------------------------------
 #
@@ -31,6 +38,7 @@ from nauti.log import get_logger
 
 @Reconciler.register(origin="ipfabric", target="netbox", collection="portchans")
 class ReconcileIPFabricNetboxPortChans(Reconciler):
+    @profiled
     async def add_items(self):
         log = get_logger()
 
@@ -43,8 +51,11 @@ class ReconcileIPFabricNetboxPortChans(Reconciler):
 
             log.info(f"CREATE:OK: {ident}.")
 
-        await self.target.add_items(self.diff_res.missing, callback=_report)
+        await get_coordinator(self.target.source).add_items(
+            self.target, self.diff_res.missing, callback=_report
+        )
 
+    @profiled
     async def update_items(self):
         nb_col = self.target
         log = get_logger()
@@ -59,8 +70,11 @@ class ReconcileIPFabricNetboxPortChans(Reconciler):
 
             log.info(f"CHANGE:OK: {ident}")
 
-        await nb_col.update_items(self.diff_res.changes, callback=_report)
+        await get_coordinator(nb_col.source).update_items(
+            nb_col, self.diff_res.changes, callback=_report
+        )
 
+    @profiled
     async def delete_items(self):
 
         """
@@ -81,4 +95,6 @@ class ReconcileIPFabricNetboxPortChans(Reconciler):
 
             log.info(f"REMOVE:OK: {ident}.")
 
-        await nb_col.delete_items(self.diff_res.extras, callback=_report)
+        await get_coordinator(nb_col.source).delete_items(
+            nb_col, self.diff_res.extras, callback=_report
+        )
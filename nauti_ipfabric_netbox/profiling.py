@@ -0,0 +1,363 @@
+"""
+This file contains the opt-in profiling hooks used to wrap each of the
+Reconciler phases.  Profiling is enabled by setting the NAUTI_PROFILE
+environment variable to an output directory, for example:
+
+    export NAUTI_PROFILE=/tmp/nauti-prof
+
+Each profiled phase is sampled by a background thread that captures the call
+stack of the event loop thread.  A sample is attributed to the phase when the
+task running on the loop is the phase task, or a task created within the
+phase; for example the per-item request tasks of a collection.  While any
+phase is profiled a loop task factory records the phases of each new task, so
+that tasks created by those tasks are attributed to the phase as well.  The
+remaining samples, taken while the loop is idle, running other tasks, or
+running callbacks outside of any task, are counted as "other".  Concurrent
+instances of the same phase, for example when reconciling multiple targets,
+are sampled separately.  For each phase the following files are written to
+the output directory:
+
+    <seq>-<phase>.folded - collapsed stacks, input for flamegraph.pl
+    <seq>-<phase>.txt    - summary of the top functions by sample count
+
+All phases are also written to "stacks.folded", and asyncio slow callbacks
+are reported to "slow-callbacks.log".  Both files are truncated the first time
+a process profiles into the output directory.  While any phase is profiled
+the asyncio debug mode is enabled to detect the slow callbacks; the loop debug
+state and task factory are restored when the last profiled phase exits.
+"""
+#  Copyright (C) 2020  Jeremy Schulman
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# -----------------------------------------------------------------------------
+# System Imports
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import asyncio
+import logging
+import threading
+from time import perf_counter
+from pathlib import Path
+from itertools import count
+from functools import wraps
+from collections import Counter
+from contextvars import ContextVar
+from weakref import WeakKeyDictionary
+
+# -----------------------------------------------------------------------------
+# Public Imports
+# -----------------------------------------------------------------------------
+
+from nauti.log import get_logger
+
+# -----------------------------------------------------------------------------
+# Exports
+# -----------------------------------------------------------------------------
+
+__all__ = ["profiled"]
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 CODE BEGINS
+#
+# -----------------------------------------------------------------------------
+
+# output directory; profiling is disabled when not set.
+PROFILE_ENV = "NAUTI_PROFILE"
+
+# sampling interval in seconds.
+PROFILE_INTERVAL_ENV = "NAUTI_PROFILE_INTERVAL"
+PROFILE_INTERVAL_DEFAULT = 0.005
+
+# asyncio callbacks that run longer than this many seconds are reported.
+PROFILE_SLOW_ENV = "NAUTI_PROFILE_SLOW"
+PROFILE_SLOW_DEFAULT = 0.1
+
+_phase_seq = count(1)
+
+# output directories used by this process; the run files are truncated on
+# first use.
+_run_dirs = set()
+
+# the phases active in the current context; inherited by the tasks created
+# within a phase.
+_active_phases: ContextVar[tuple] = ContextVar(
+    "nauti_ipfabric_netbox_phases", default=()
+)
+
+# the phases of each task created while profiling, by task.
+_task_phases = WeakKeyDictionary()
+
+
+def profiled(method):
+    """
+    Decorator for a Reconciler phase coroutine method.  When the NAUTI_PROFILE
+    environment variable is not set the method is called without any
+    additional processing.
+    """
+
+    @wraps(method)
+    async def wrapper(self, *vargs, **kwargs):
+        if not (out_dir := os.environ.get(PROFILE_ENV)):
+            return await method(self, *vargs, **kwargs)
+
+        # create the coroutine here so the sampler can match its frame; the
+        # code object alone is shared by concurrent instances of the phase.
+
+        phase = f"{type(self).__name__}.{method.__name__}"
+        coro = method(self, *vargs, **kwargs)
+        sampler = _PhaseSampler(phase=phase, frame=coro.cr_frame, out_dir=Path(out_dir))
+
+        with sampler:
+            return await coro
+
+    return wrapper
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{code.co_name}"
+
+
+def _start_run(out_dir: Path):
+    """
+    Create the output directory and truncate the run files the first time this
+    process profiles into it, so that a previous run is not mixed into the
+    flamegraph.
+    """
+    if out_dir in _run_dirs:
+        return
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for filename in ("stacks.folded", "slow-callbacks.log"):
+        (out_dir / filename).write_text("")
+
+    _run_dirs.add(out_dir)
+
+
+def _phases_task_factory(factory):
+    """
+    Return a loop task factory that records the phases active in the context
+    of each new task, calling the original `factory` to create the task.
+    """
+
+    def _create_task(loop, coro, **kwargs):
+        if factory is None:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        else:
+            task = factory(loop, coro, **kwargs)
+
+        if (context := kwargs.get("context")) is not None:
+            phases = context.get(_active_phases, ())
+        else:
+            phases = _active_phases.get()
+
+        if phases:
+            _task_phases[task] = phases
+
+        return task
+
+    return _create_task
+
+
+class _LoopHooks(object):
+    """
+    Reference counted event loop hooks used while any phase is profiled: the
+    asyncio debug mode to report slow callbacks, and the task factory that
+    records the phases of each new task.  The first phase to start saves the
+    loop state and attaches the slow-callbacks file handler to the asyncio
+    logger; the last phase to stop restores them.
+    """
+
+    active = 0
+    saved = None
+
+    @classmethod
+    def start(cls, out_dir: Path):
+        cls.active += 1
+        if cls.active > 1:
+            return
+
+        loop = asyncio.get_running_loop()
+        aio_log = logging.getLogger("asyncio")
+        handler = logging.FileHandler(out_dir / "slow-callbacks.log")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+
+        cls.saved = (
+            loop,
+            loop.get_debug(),
+            loop.slow_callback_duration,
+            loop.get_task_factory(),
+            handler,
+            aio_log.level,
+        )
+
+        aio_log.addHandler(handler)
+        aio_log.setLevel(min(aio_log.getEffectiveLevel(), logging.WARNING))
+        loop.slow_callback_duration = float(
+            os.environ.get(PROFILE_SLOW_ENV, PROFILE_SLOW_DEFAULT)
+        )
+        loop.set_task_factory(_phases_task_factory(loop.get_task_factory()))
+        loop.set_debug(True)
+
+    @classmethod
+    def stop(cls):
+        cls.active -= 1
+        if cls.active:
+            return
+
+        loop, debug, slow_duration, factory, handler, log_level = cls.saved
+        cls.saved = None
+
+        loop.set_debug(debug)
+        loop.slow_callback_duration = slow_duration
+        loop.set_task_factory(factory)
+
+        aio_log = logging.getLogger("asyncio")
+        aio_log.removeHandler(handler)
+        aio_log.setLevel(log_level)
+        handler.close()
+
+
+class _PhaseSampler(object):
+    """
+    Context manager that samples the stack of the calling thread from a
+    background thread until the context exits, and then writes the phase
+    profile files.  The phase is active in the context of the calling task, so
+    the tasks created within the context are attributed to the phase.
+    """
+
+    def __init__(self, phase, frame, out_dir: Path):
+        self.phase = phase
+        self.frame = frame
+        self.out_dir = out_dir
+        self.seq = next(_phase_seq)
+        self.interval = float(
+            os.environ.get(PROFILE_INTERVAL_ENV, PROFILE_INTERVAL_DEFAULT)
+        )
+        self.stacks = Counter()
+        self.other = 0
+        self.elapsed = 0.0
+        self._loop = None
+        self._task = None
+        self._token = None
+        self._thread_id = None
+        self._done = threading.Event()
+        self._thread = None
+        self._started = 0.0
+
+    def __enter__(self):
+        _start_run(self.out_dir)
+        _LoopHooks.start(self.out_dir)
+
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        self._token = _active_phases.set(_active_phases.get() + (self,))
+
+        self._thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._started = perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.elapsed = perf_counter() - self._started
+        self._done.set()
+        self._thread.join()
+        _active_phases.reset(self._token)
+        _LoopHooks.stop()
+        self._write()
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            if (stack := self._sample_stack()) is None:
+                self.other += 1
+                continue
+
+            self.stacks[tuple(_frame_name(fr) for fr in reversed(stack))] += 1
+
+    def _sample_stack(self):
+        """
+        Return the loop thread stack, from the top frame down to the phase
+        coroutine or the coroutine of the phase task running it, or None when
+        the loop is not running the phase.
+        """
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            return None
+
+        if task is self._task:
+            bottom = self.frame
+        elif self in _task_phases.get(task, ()):
+            bottom = getattr(task.get_coro(), "cr_frame", None)
+        else:
+            return None
+
+        frame = sys._current_frames().get(self._thread_id)
+        stack = list()
+
+        while frame is not None:
+            stack.append(frame)
+            if frame is bottom:
+                return stack
+            frame = frame.f_back
+
+        # the loop switched tasks while sampling.
+        return None
+
+    def _write(self):
+        base = str(self.out_dir / f"{self.seq:03d}-{self.phase}")
+
+        folded = [
+            ";".join((self.phase,) + stack) + f" {samples}"
+            for stack, samples in self.stacks.most_common()
+        ]
+
+        if folded:
+            Path(base + ".folded").write_text("\n".join(folded) + "\n")
+            with open(self.out_dir / "stacks.folded", "a") as ofile:
+                ofile.write("\n".join(folded) + "\n")
+
+        own = Counter()
+        cumulative = Counter()
+
+        for stack, samples in self.stacks.items():
+            own[stack[-1]] += samples
+            for name in set(stack):
+                cumulative[name] += samples
+
+        busy = sum(self.stacks.values())
+        lines = [
+            f"phase: {self.phase}",
+            f"elapsed: {self.elapsed:.3f}s",
+            f"samples: {busy} in phase, {self.other} other, "
+            f"interval {self.interval}s",
+            "",
+            "top functions by own samples:",
+            *(f"{samples:8d}  {name}" for name, samples in own.most_common(25)),
+            "",
+            "top functions by cumulative samples:",
+            *(f"{samples:8d}  {name}" for name, samples in cumulative.most_common(25)),
+        ]
+
+        Path(base + ".txt").write_text("\n".join(lines) + "\n")
+
+        get_logger().info(
+            f"PROFILE: {self.phase}: {self.elapsed:.3f}s, {busy} phase samples -> {base}"
+        )
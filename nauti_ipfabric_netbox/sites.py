@@ -21,6 +21,12 @@ from httpx import Response
 from nauti.tasks.reconile import Reconciler
 from nauti.log import get_logger
 
+# -----------------------------------------------------------------------------
+# Private Imports
+# -----------------------------------------------------------------------------
+
+from nauti_ipfabric_netbox.profiling import profiled
+
 
 @Reconciler.register(origin="ipfabric", target="netbox", collection="sites")
 class IPFabricNetboxSitesReconciler(Reconciler):
@@ -31,6 +37,7 @@ class IPFabricNetboxSitesReconciler(Reconciler):
     #
     # -------------------------------------------------------------------------
 
+    @profiled
     async def add_items(self):
         log = get_logger()
         nb_col = self.target
@@ -54,6 +61,7 @@ class IPFabricNetboxSitesReconciler(Reconciler):
     #
     # -------------------------------------------------------------------------
 
+    @profiled
     async def update_items(self):
         get_logger().warning("Site changes not supported at this time.")
 
@@ -63,5 +71,6 @@ class IPFabricNetboxSitesReconciler(Reconciler):
     #
     # -------------------------------------------------------------------------
 
+    @profiled
     async def delete_items(self):
         get_logger().warning("Site removal not supported at this time.")
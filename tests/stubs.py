@@ -0,0 +1,236 @@
+"""
+Stub IP Fabric and Netbox sources and collections used to run the Reconcilers
+without either system.  The stub collections key the records as follows:
+
+    devices     -> (hostname,)
+    interfaces  -> (hostname, interface)
+    ipaddrs     -> (hostname, ipaddr)
+"""
+
+import asyncio
+from collections import namedtuple
+from itertools import count
+
+DiffResults = namedtuple(
+    "DiffResults", ["origin", "target", "missing", "changes", "extras"]
+)
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 IP Fabric
+#
+# -----------------------------------------------------------------------------
+
+IPF_RECORDS = {
+    "devices": [
+        {"hostname": "switch1", "sn": "SN1", "loginIp": "10.0.0.1"},
+        {"hostname": "switch2", "sn": "SN2", "loginIp": "10.0.0.2"},
+    ],
+    "ipaddrs": [
+        {"hostname": "switch1", "intName": "mgmt0", "ip": "10.0.0.1"},
+        {"hostname": "switch2", "intName": "mgmt0", "ip": "10.0.0.2"},
+    ],
+    "interfaces": [
+        {"hostname": "switch1", "intName": "mgmt0", "dscr": "management"},
+        {"hostname": "switch2", "intName": "mgmt0", "dscr": "management"},
+    ],
+}
+
+IPF_ITEMS = {
+    "devices": lambda rec: {"hostname": rec["hostname"], "ipaddr": rec["loginIp"]},
+    "ipaddrs": lambda rec: {
+        "hostname": rec["hostname"],
+        "interface": rec["intName"],
+        "ipaddr": rec["ip"] + "/32",
+    },
+    "interfaces": lambda rec: {
+        "hostname": rec["hostname"],
+        "interface": rec["intName"],
+        "description": rec["dscr"],
+    },
+}
+
+
+def _item_key(name, item):
+    if name == "devices":
+        return (item["hostname"],)
+    if name == "interfaces":
+        return item["hostname"], item["interface"]
+    return item["hostname"], item["ipaddr"]
+
+
+class StubIPFSource(object):
+    def __init__(self, error=None):
+        self.error = error
+        self.fetches = list()
+
+
+class StubIPFCollection(object):
+    """ IP Fabric collection returning the IPF_RECORDS matching the filters """
+
+    def __init__(self, source, name):
+        self.source = source
+        self.name = name
+        self.source_records = list()
+        self.source_record_keys = dict()
+        self.items = dict()
+        self.cache = dict()
+
+    async def fetch(self, filters="", **params):
+        self.source.fetches.append(self.name)
+        await asyncio.sleep(0)
+        if self.source.error:
+            raise self.source.error
+
+        self.source_records.extend(
+            rec for rec in IPF_RECORDS[self.name] if f"'{rec['hostname']}'" in filters
+        )
+
+    def make_keys(self):
+        for rec in self.source_records:
+            item = IPF_ITEMS[self.name](rec)
+            key = _item_key(self.name, item)
+            self.source_record_keys[key] = rec
+            self.items[key] = item
+
+
+def ipf_collection(name, source=None):
+    """ return the fetched and keyed IP Fabric collection """
+    ipf_col = StubIPFCollection(source or StubIPFSource(), name)
+    ipf_col.source_records = list(IPF_RECORDS[name])
+    ipf_col.make_keys()
+    return ipf_col
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 Netbox
+#
+# -----------------------------------------------------------------------------
+
+
+class StubResponse(object):
+    def __init__(self, data=None, status_code=200, api_version="2.10"):
+        self.data = data
+        self.status_code = status_code
+        self.is_error = status_code >= 400
+        self.text = "" if not self.is_error else "FAIL"
+        self.headers = {"API-Version": api_version}
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.is_error:
+            raise RuntimeError(self.text)
+
+
+class StubClient(object):
+    """ Netbox source client, records the bulk requests """
+
+    def __init__(self, base_url="https://netbox/api", status_code=200):
+        self.base_url = base_url
+        self.status_code = status_code
+        self.requests = list()
+
+    async def patch(self, url, json):
+        self.requests.append(("PATCH", url, json))
+        await asyncio.sleep(0)
+        return StubResponse(json, status_code=self.status_code)
+
+
+class StubConfig(object):
+    def __init__(self):
+        self.options = dict()
+
+
+class StubNetboxSource(object):
+    """
+    Netbox source; records the collection requests, and the number of items
+    in flight.
+    """
+
+    def __init__(self, error=None, client=None, api_version="2.10", delay=0.01):
+        self.error = error
+        self.client = client
+        self.api_version = api_version
+        self.delay = delay
+        self.requests = list()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.cancelled = False
+        self.record_ids = count(1)
+
+
+class StubNetboxCollection(object):
+    def __init__(self, source, name):
+        self.source = source
+        self.name = name
+        self.source_records = list()
+        self.source_record_keys = dict()
+        self.items = dict()
+        self.cache = dict()
+        self.config = StubConfig()
+
+    async def fetch(self, **params):
+        if self.source.error:
+            raise self.source.error
+
+    async def fetch_items(self, items):
+        pass
+
+    def make_keys(self):
+        for rec in self.source_records:
+            key = _item_key(self.name, rec)
+            self.source_record_keys[key] = rec
+            self.items[key] = rec
+
+    async def _request(self, method, items, callback):
+        source = self.source
+        source.requests.append((method, self.name, dict(items)))
+        source.in_flight += len(items)
+        source.max_in_flight = max(source.max_in_flight, source.in_flight)
+
+        try:
+            await asyncio.sleep(source.delay)
+        except asyncio.CancelledError:
+            source.cancelled = True
+            raise
+        finally:
+            source.in_flight -= len(items)
+
+        for key, fields in items.items():
+            rec = dict(fields, id=next(source.record_ids))
+            if callback:
+                callback((key, fields), StubResponse(rec, api_version=source.api_version))
+
+    async def add_items(self, items, callback=None):
+        await self._request("POST", items, callback)
+
+    async def update_items(self, items, callback=None):
+        await self._request("PATCH", items, callback)
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 nauti
+#
+# -----------------------------------------------------------------------------
+
+
+def get_collection(source, name):
+    if isinstance(source, StubIPFSource):
+        return StubIPFCollection(source, name)
+    return StubNetboxCollection(source, name)
+
+
+def diff(origin, target):
+    missing = {key: item for key, item in origin.items.items() if key not in target.items}
+    extras = {key: item for key, item in target.items.items() if key not in origin.items}
+    if not (missing or extras):
+        return None
+
+    return DiffResults(
+        origin=origin, target=target, missing=missing, changes={}, extras=extras
+    )
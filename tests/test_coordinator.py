@@ -0,0 +1,346 @@
+import asyncio
+
+import pytest
+
+from nauti_ipfabric_netbox.coordinator import (
+    WriteCoordinator,
+    coordinated,
+    coordinated_writes,
+    get_coordinator,
+)
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 Test Stubs
+#
+# -----------------------------------------------------------------------------
+
+
+class StubResponse(object):
+    is_error = False
+
+
+class InFlight(object):
+    """ tracks the number of requests in flight, in total and per key """
+
+    def __init__(self):
+        self.total = 0
+        self.max_total = 0
+        self.keys = dict()
+        self.max_key = 0
+
+    def begin(self, key):
+        self.total += 1
+        self.max_total = max(self.max_total, self.total)
+        self.keys[key] = self.keys.get(key, 0) + 1
+        self.max_key = max(self.max_key, self.keys[key])
+
+    def end(self, key):
+        self.total -= 1
+        self.keys[key] -= 1
+
+
+class StubCollection(object):
+    def __init__(self, name, in_flight=None, delay=0.01, error=None):
+        self.name = name
+        self.in_flight = in_flight or InFlight()
+        self.delay = delay
+        self.error = error
+        self.calls = list()
+
+    async def _request(self, op, items, callback):
+        self.calls.append((op, {key: dict(fields) for key, fields in items.items()}))
+        for key in items:
+            self.in_flight.begin(key)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            for key in items:
+                self.in_flight.end(key)
+
+        if self.error:
+            raise self.error
+
+        for item in items.items():
+            if callback:
+                callback(item, StubResponse())
+
+    async def add_items(self, items, callback=None):
+        await self._request("add", items, callback)
+
+    async def update_items(self, items, callback=None):
+        await self._request("update", items, callback)
+
+    async def delete_items(self, items, callback=None):
+        await self._request("delete", items, callback)
+
+
+KEY = ("switch1", "Ethernet1")
+
+
+async def _queued():
+    """ let the tasks created so far run until they block """
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 Tests
+#
+# -----------------------------------------------------------------------------
+
+
+@pytest.mark.asyncio
+async def test_coordinator_merge_queued_updates():
+    coord = WriteCoordinator()
+    col = StubCollection("interfaces")
+    reported = list()
+
+    first = asyncio.create_task(coord.update_items(col, {KEY: {"description": "a"}}))
+    await _queued()
+
+    await asyncio.gather(
+        coord.update_items(
+            col, {KEY: {"mtu": 9000}}, callback=lambda i, r: reported.append(i)
+        ),
+        coord.update_items(
+            col, {KEY: {"enabled": True}}, callback=lambda i, r: reported.append(i)
+        ),
+    )
+    await first
+
+    assert col.calls == [
+        ("update", {KEY: {"description": "a"}}),
+        ("update", {KEY: {"mtu": 9000, "enabled": True}}),
+    ]
+    assert len(reported) == 2
+
+
+@pytest.mark.asyncio
+async def test_coordinator_skip_created():
+    coord = WriteCoordinator()
+    col_devices = StubCollection("interfaces")
+    col_ifaces = StubCollection("interfaces")
+    reported = list()
+
+    await asyncio.gather(
+        coord.add_items(
+            col_devices, {KEY: {}}, callback=lambda i, r: reported.append(r)
+        ),
+        coord.add_items(
+            col_ifaces, {KEY: {}}, callback=lambda i, r: reported.append(r)
+        ),
+    )
+
+    assert len(col_devices.calls) + len(col_ifaces.calls) == 1
+    assert len(reported) == 2
+    assert reported[0] is reported[1]
+
+
+@pytest.mark.asyncio
+async def test_coordinator_serialize_same_key():
+    coord = WriteCoordinator()
+    in_flight = InFlight()
+    col_ifaces = StubCollection("interfaces", in_flight=in_flight)
+    col_portchans = StubCollection("portchans", in_flight=in_flight)
+
+    await asyncio.gather(
+        coord.update_items(col_ifaces, {KEY: {"description": "a"}}),
+        coord.update_items(col_portchans, {KEY: {"portchan": "Po1"}}),
+        coord.delete_items(col_portchans, {KEY: {}}),
+    )
+
+    assert len(col_ifaces.calls) + len(col_portchans.calls) == 3
+    assert in_flight.max_key == 1
+
+
+@pytest.mark.asyncio
+async def test_coordinator_batch_keys():
+    coord = WriteCoordinator()
+    col = StubCollection("interfaces")
+    items = {("switch1", f"Ethernet{num}"): {"mtu": 9000} for num in range(5)}
+
+    await coord.update_items(col, items)
+
+    assert col.calls == [("update", items)]
+    assert col.in_flight.max_total == 5
+
+
+@pytest.mark.asyncio
+async def test_coordinator_batch_limit():
+    coord = WriteCoordinator(limit=2)
+    col = StubCollection("interfaces")
+    items = {("switch1", f"Ethernet{num}"): {} for num in range(5)}
+
+    await coord.add_items(col, items)
+
+    assert [len(call_items) for _, call_items in col.calls] == [2, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_coordinator_batch_skip_created():
+    coord = WriteCoordinator()
+    col_devices = StubCollection("interfaces")
+    col_ifaces = StubCollection("interfaces")
+    reported = list()
+
+    await coord.add_items(col_devices, {KEY: {}})
+    await coord.add_items(
+        col_ifaces,
+        {KEY: {}, ("switch2", "Ethernet1"): {}},
+        callback=lambda i, r: reported.append(i[0]),
+    )
+
+    # only the item not already created is sent, and the callback is called
+    # for both.
+
+    assert col_ifaces.calls == [("add", {("switch2", "Ethernet1"): {}})]
+    assert sorted(reported) == sorted([KEY, ("switch2", "Ethernet1")])
+
+
+@pytest.mark.asyncio
+async def test_coordinator_write_limit():
+    in_flight = InFlight()
+    col_ifaces = StubCollection("interfaces", in_flight=in_flight)
+    col_ipaddrs = StubCollection("ipaddrs", in_flight=in_flight)
+    source = object()
+
+    with coordinated_writes(limit=2):
+        coord = get_coordinator(source)
+        await asyncio.gather(
+            coord.update_items(col_ifaces, {("switch1", n): {} for n in range(4)}),
+            coord.add_items(col_ipaddrs, {("switch1", n): {} for n in range(4)}),
+            get_coordinator(source).delete_items(
+                col_ifaces, {("switch2", n): {} for n in range(4)}
+            ),
+        )
+
+    assert in_flight.max_total == 2
+
+
+@pytest.mark.asyncio
+async def test_coordinator_hold():
+    coord = WriteCoordinator()
+    col = StubCollection("devices")
+    order = list()
+
+    async def _bulk():
+        async with coord.hold(col, [KEY, ("switch2",)]):
+            order.append("bulk-begin")
+            await asyncio.sleep(0.01)
+            order.append("bulk-end")
+
+    bulk = asyncio.create_task(_bulk())
+    await _queued()
+    await coord.update_items(col, {KEY: {"serial": "X"}})
+    await bulk
+
+    order.append("update-end")
+    assert order == ["bulk-begin", "bulk-end", "update-end"]
+
+
+@pytest.mark.asyncio
+async def test_coordinator_cancel_queued_owner():
+    coord = WriteCoordinator()
+    col = StubCollection("interfaces")
+    reported = list()
+
+    first = asyncio.create_task(coord.update_items(col, {KEY: {"description": "a"}}))
+    await _queued()
+
+    owner = asyncio.create_task(coord.update_items(col, {KEY: {"mtu": 9000}}))
+    await _queued()
+
+    merged = asyncio.create_task(
+        coord.update_items(
+            col, {KEY: {"enabled": True}}, callback=lambda i, r: reported.append(i)
+        )
+    )
+    await _queued()
+
+    owner.cancel()
+    await asyncio.gather(first, merged)
+
+    with pytest.raises(asyncio.CancelledError):
+        await owner
+
+    # the merged changes are sent without the cancelled changes, and later
+    # updates are not lost.
+
+    await coord.update_items(col, {KEY: {"description": "b"}})
+
+    assert col.calls == [
+        ("update", {KEY: {"description": "a"}}),
+        ("update", {KEY: {"enabled": True}}),
+        ("update", {KEY: {"description": "b"}}),
+    ]
+    assert reported == [(KEY, {"enabled": True})]
+
+
+@pytest.mark.asyncio
+async def test_coordinator_error_queued_owner():
+    coord = WriteCoordinator()
+    col = StubCollection("interfaces", error=RuntimeError("FAIL"))
+
+    first = asyncio.create_task(coord.update_items(col, {KEY: {"description": "a"}}))
+    await _queued()
+
+    owner = asyncio.create_task(coord.update_items(col, {KEY: {"mtu": 9000}}))
+    await _queued()
+
+    with pytest.raises(RuntimeError):
+        await coord.update_items(col, {KEY: {"enabled": True}})
+
+    for task in (first, owner):
+        with pytest.raises(RuntimeError):
+            await task
+
+    col.error = None
+    await coord.update_items(col, {KEY: {"description": "b"}})
+    assert col.calls[-1] == ("update", {KEY: {"description": "b"}})
+
+
+@pytest.mark.asyncio
+async def test_coordinator_run_scope():
+    source = object()
+    col = StubCollection("interfaces")
+
+    assert get_coordinator(source) is not get_coordinator(source)
+
+    with coordinated_writes():
+        coord = get_coordinator(source)
+        assert get_coordinator(source) is coord
+        assert get_coordinator(object()) is not coord
+        await coord.add_items(col, {KEY: {}})
+
+    # a new run does not skip creates made by a previous run.
+
+    with coordinated_writes():
+        assert get_coordinator(source) is not coord
+        await get_coordinator(source).add_items(col, {KEY: {}})
+
+    assert len(col.calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_coordinator_coordinated_phase():
+    source = object()
+    coords = list()
+
+    class StubReconciler(object):
+        @coordinated
+        async def add_items(self):
+            coords.append(get_coordinator(source))
+            coords.append(get_coordinator(source))
+
+    await StubReconciler().add_items()
+    assert coords[0] is coords[1]
+
+    # within a Caller run the phase uses the coordinator of the run.
+
+    with coordinated_writes():
+        await StubReconciler().add_items()
+        assert coords[2] is coords[3] is get_coordinator(source)
+        assert coords[2] is not coords[0]
@@ -0,0 +1,163 @@
+import asyncio
+
+import pytest
+
+from nauti_ipfabric_netbox import devices
+from nauti_ipfabric_netbox.devices import (
+    IPFabricNetboxDeviceCollectionReconciler,
+    _netbox_bulk_supported,
+)
+
+from stubs import (
+    StubClient,
+    StubIPFSource,
+    StubNetboxCollection,
+    StubNetboxSource,
+    diff,
+    get_collection,
+    ipf_collection,
+)
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 Test Stubs
+#
+# -----------------------------------------------------------------------------
+
+
+@pytest.fixture(autouse=True)
+def stub_nauti(monkeypatch):
+    monkeypatch.setattr(devices, "get_collection", get_collection)
+    monkeypatch.setattr(devices, "diff", diff)
+
+
+def _reconciler(nb_source, ipf_source=None):
+    nb_col = StubNetboxCollection(nb_source, "devices")
+    diff_res = diff(origin=ipf_collection("devices", ipf_source), target=nb_col)
+    return IPFabricNetboxDeviceCollectionReconciler(diff_res=diff_res)
+
+
+def _requests(nb_source, method, name):
+    return [
+        items for _method, _name, items in nb_source.requests
+        if (_method, _name) == (method, name)
+    ]
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 Tests
+#
+# -----------------------------------------------------------------------------
+
+
+@pytest.mark.asyncio
+async def test_devices_add_items_bulk_primary():
+    client = StubClient()
+    nb_source = StubNetboxSource(client=client)
+    ipf_source = StubIPFSource()
+
+    rcler = _reconciler(nb_source, ipf_source)
+    await rcler.add_items()
+
+    # the devices, interfaces, and ipaddrs are each created in one coordinated
+    # batch, and the primary IPs are assigned in one bulk request.
+
+    for name in ("devices", "interfaces", "ipaddrs"):
+        assert [len(items) for items in _requests(nb_source, "POST", name)] == [2]
+
+    assert not _requests(nb_source, "PATCH", "devices")
+
+    nb_devices = rcler.target.source_record_keys
+    nb_ipaddrs = rcler.target.cache["ipaddrs"].source_record_keys
+
+    assert client.requests == [
+        (
+            "PATCH",
+            "/dcim/devices/",
+            [
+                {
+                    "id": nb_devices[("switch1",)]["id"],
+                    "primary_ip4": nb_ipaddrs[("switch1", "10.0.0.1/32")]["id"],
+                },
+                {
+                    "id": nb_devices[("switch2",)]["id"],
+                    "primary_ip4": nb_ipaddrs[("switch2", "10.0.0.2/32")]["id"],
+                },
+            ],
+        )
+    ]
+
+    # the IP Fabric ipaddrs are looked up in one request, and the interfaces
+    # per device.
+
+    assert sorted(ipf_source.fetches) == ["interfaces", "interfaces", "ipaddrs"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "nb_source",
+    [
+        StubNetboxSource(client=None),
+        StubNetboxSource(client=StubClient(base_url="https://netbox")),
+        StubNetboxSource(client=StubClient(), api_version="2.9"),
+        StubNetboxSource(client=StubClient(), api_version=None),
+    ],
+    ids=["no-client", "base-url", "api-version", "no-api-version"],
+)
+async def test_devices_add_items_fallback(nb_source):
+    await _reconciler(nb_source).add_items()
+
+    # the bulk request is not supported, so the primary IPs are assigned with
+    # the devices collection update.
+
+    if nb_source.client:
+        assert nb_source.client.requests == []
+
+    assert _requests(nb_source, "PATCH", "devices") == [
+        {
+            ("switch1",): {"ipaddr": "10.0.0.1"},
+            ("switch2",): {"ipaddr": "10.0.0.2"},
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_devices_add_items_bulk_error():
+    client = StubClient(status_code=400)
+    nb_source = StubNetboxSource(client=client)
+
+    await _reconciler(nb_source).add_items()
+
+    assert len(client.requests) == 1
+    assert _requests(nb_source, "PATCH", "devices") == [
+        {
+            ("switch1",): {"ipaddr": "10.0.0.1"},
+            ("switch2",): {"ipaddr": "10.0.0.2"},
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_devices_add_items_cancel_on_error():
+    nb_source = StubNetboxSource(client=StubClient(), delay=1)
+    ipf_source = StubIPFSource(error=RuntimeError("unreachable"))
+
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(_reconciler(nb_source, ipf_source).add_items(), 0.5)
+
+    # the device creates are cancelled when the IP Fabric lookup fails.
+
+    assert nb_source.cancelled
+    assert nb_source.in_flight == 0
+
+
+def test_netbox_bulk_supported():
+    client = StubClient(base_url="https://netbox/api/")
+
+    assert _netbox_bulk_supported(StubNetboxSource(client=client), "3.1")
+    assert _netbox_bulk_supported(StubNetboxSource(client=client), "2.10")
+    assert not _netbox_bulk_supported(StubNetboxSource(client=client), "2.9")
+    assert not _netbox_bulk_supported(StubNetboxSource(client=client), "")
+    assert not _netbox_bulk_supported(StubNetboxSource(), "3.1")
@@ -0,0 +1,136 @@
+import pytest
+
+from nauti_ipfabric_netbox import devices, fanout
+from nauti_ipfabric_netbox.devices import IPFabricNetboxDeviceCollectionReconciler
+from nauti_ipfabric_netbox.ipaddrs import ReconcileIPFabricNetboxIPaddrs
+
+from stubs import (
+    StubClient,
+    StubIPFSource,
+    StubNetboxSource,
+    diff,
+    get_collection,
+    ipf_collection,
+)
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 Test Stubs
+#
+# -----------------------------------------------------------------------------
+
+
+@pytest.fixture(autouse=True)
+def stub_nauti(monkeypatch):
+    for module in (devices, fanout):
+        monkeypatch.setattr(module, "get_collection", get_collection)
+        monkeypatch.setattr(module, "diff", diff)
+
+
+def _posted(nb_source, name):
+    """ return the number of items in each create request of the collection """
+    return [
+        len(items) for method, _name, items in nb_source.requests
+        if (method, _name) == ("POST", name)
+    ]
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 Tests
+#
+# -----------------------------------------------------------------------------
+
+
+@pytest.mark.asyncio
+async def test_fanout_targets():
+    ipf_source = StubIPFSource()
+    origin = ipf_collection("devices", ipf_source)
+    targets = {
+        "staging": StubNetboxSource(client=StubClient()),
+        "production": StubNetboxSource(client=StubClient()),
+        "replica": StubNetboxSource(error=RuntimeError("unreachable")),
+    }
+
+    results = await fanout.reconcile_targets(
+        origin, targets, reconciler=IPFabricNetboxDeviceCollectionReconciler
+    )
+
+    # the IP Fabric primary IP lookups are done once for all targets; the
+    # ipaddrs are fetched in one batch, and the interfaces per device.
+
+    assert sorted(ipf_source.fetches) == ["interfaces", "interfaces", "ipaddrs"]
+
+    assert set(results) == set(targets)
+    for name in ("staging", "production"):
+        source = targets[name]
+        assert results[name].target.source is source
+        assert results[name].missing == origin.items
+
+        for col_name in ("devices", "interfaces", "ipaddrs"):
+            assert _posted(source, col_name) == [2]
+
+        assert len(source.client.requests) == 1
+
+    assert isinstance(results["replica"], RuntimeError)
+
+    # without a write limit both devices are created concurrently.
+    assert targets["staging"].max_in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_fanout_lookups_scope():
+    ipf_source = StubIPFSource()
+    origin = ipf_collection("devices", ipf_source)
+
+    for _ in range(2):
+        await fanout.reconcile_targets(
+            origin,
+            {"staging": StubNetboxSource()},
+            reconciler=IPFabricNetboxDeviceCollectionReconciler,
+        )
+        assert fanout.ORIGIN_LOOKUPS not in origin.cache
+
+    # the lookups are not reused by a later call, which may be for a newer
+    # IP Fabric snapshot.
+
+    assert sorted(ipf_source.fetches) == ["interfaces"] * 4 + ["ipaddrs"] * 2
+
+
+@pytest.mark.asyncio
+async def test_fanout_write_limit():
+    origin = ipf_collection("devices")
+    targets = {"staging": StubNetboxSource(), "production": StubNetboxSource()}
+
+    await fanout.reconcile_targets(
+        origin,
+        targets,
+        reconciler=IPFabricNetboxDeviceCollectionReconciler,
+        write_limit=1,
+    )
+
+    for source in targets.values():
+        assert source.max_in_flight == 1
+        assert _posted(source, "devices") == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_reconcile_collections():
+    target = StubNetboxSource(client=StubClient())
+
+    results = await fanout.reconcile_collections(
+        [
+            (ipf_collection("devices"), IPFabricNetboxDeviceCollectionReconciler),
+            (ipf_collection("ipaddrs"), ReconcileIPFabricNetboxIPaddrs),
+        ],
+        target,
+    )
+
+    assert set(results) == {"devices", "ipaddrs"}
+    assert not any(isinstance(res, Exception) for res in results.values())
+
+    # both collections create the primary ipaddrs of the devices; each is only
+    # created once since the collections share the write coordinator of the run.
+
+    assert sum(_posted(target, "ipaddrs")) == 2
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from time import perf_counter
+
+import pytest
+
+from nauti_ipfabric_netbox.profiling import profiled
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 Test Stubs
+#
+# -----------------------------------------------------------------------------
+
+
+def _spin(seconds):
+    """ keep the loop thread busy, without yielding to other tasks """
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        pass
+
+
+async def _spin_task(seconds):
+    _spin(seconds)
+
+
+class StubReconciler(object):
+    @profiled
+    async def spin(self):
+        # the loop only times the callbacks that start once debug is enabled.
+        await asyncio.sleep(0)
+        _spin(0.05)
+        await asyncio.sleep(0)
+
+    @profiled
+    async def spin_child(self):
+        await asyncio.create_task(_spin_task(0.05))
+
+    @profiled
+    async def wait(self):
+        await asyncio.sleep(0.08)
+
+    @profiled
+    async def outer(self):
+        await self.spin()
+
+
+@pytest.fixture()
+def out_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("NAUTI_PROFILE", str(tmp_path))
+    monkeypatch.setenv("NAUTI_PROFILE_INTERVAL", "0.001")
+    return tmp_path
+
+
+def _folded(out_dir, phase):
+    (path,) = out_dir.glob(f"*-StubReconciler.{phase}.folded")
+    return path.read_text()
+
+
+# -----------------------------------------------------------------------------
+#
+#                                 Tests
+#
+# -----------------------------------------------------------------------------
+
+
+@pytest.mark.asyncio
+async def test_profiled_disabled(tmp_path, monkeypatch):
+    monkeypatch.delenv("NAUTI_PROFILE", raising=False)
+    await StubReconciler().spin()
+    assert asyncio.get_running_loop().get_task_factory() is None
+
+
+@pytest.mark.asyncio
+async def test_profiled_files(out_dir):
+    await StubReconciler().spin()
+
+    assert "StubReconciler.spin;" in _folded(out_dir, "spin")
+    assert "test_profiling:_spin " in (out_dir / "stacks.folded").read_text()
+
+    (summary,) = out_dir.glob("*-StubReconciler.spin.txt")
+    assert "samples:" in summary.read_text()
+    assert (out_dir / "slow-callbacks.log").exists()
+
+
+@pytest.mark.asyncio
+async def test_profiled_restores_loop(out_dir, monkeypatch):
+    monkeypatch.setenv("NAUTI_PROFILE_SLOW", "0.02")
+
+    loop = asyncio.get_running_loop()
+    aio_log = logging.getLogger("asyncio")
+    saved = (
+        loop.get_debug(),
+        loop.slow_callback_duration,
+        loop.get_task_factory(),
+        list(aio_log.handlers),
+        aio_log.level,
+    )
+
+    await StubReconciler().spin()
+
+    assert saved == (
+        loop.get_debug(),
+        loop.slow_callback_duration,
+        loop.get_task_factory(),
+        list(aio_log.handlers),
+        aio_log.level,
+    )
+    assert (out_dir / "slow-callbacks.log").read_text()
+
+
+@pytest.mark.asyncio
+async def test_profiled_nested(out_dir):
+    await StubReconciler().outer()
+
+    assert "test_profiling:_spin " in _folded(out_dir, "outer")
+    assert "test_profiling:_spin " in _folded(out_dir, "spin")
+    assert asyncio.get_running_loop().get_debug() is False
+
+
+@pytest.mark.asyncio
+async def test_profiled_concurrent_child_tasks(out_dir):
+    rcler = StubReconciler()
+    await asyncio.gather(rcler.spin_child(), rcler.wait())
+
+    # the work of the child task is attributed to the phase that created it,
+    # and not to the phase running concurrently.
+
+    assert "test_profiling:_spin_task;test_profiling:_spin " in _folded(
+        out_dir, "spin_child"
+    )
+    for path in out_dir.glob("*-StubReconciler.wait.folded"):
+        assert "test_profiling:_spin" not in path.read_text()